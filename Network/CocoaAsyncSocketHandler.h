@@ -11,11 +11,13 @@ NS_ASSUME_NONNULL_BEGIN
 
 typedef void (^ResponseBlock)(NSString *response);
 typedef void (^ConnectionCallback)(BOOL success);
+typedef void (^DataBlock)(NSData *data);
 
 @interface CocoaAsyncSocketHandler : NSObject
 
 @property (nonatomic, copy) ResponseBlock getResponseBlock;
 @property (nonatomic, copy) ConnectionCallback connectionCallback;
+@property (nonatomic, copy, nullable) DataBlock getDataBlock; // raw bytes from the server (binary acknowledgments)
 
 // Setup connection with host and port
 - (void)setupSocketHost:(NSString *)host port:(NSInteger)port;
@@ -72,6 +72,12 @@
 
 // Delegate method: Data received (optional, can be used for simple acknowledgments)
 - (void)socket:(GCDAsyncSocket *)sock didReadData:(NSData *)data withTag:(long)tag {
+    if (self.getDataBlock) {
+        self.getDataBlock(data);
+        [self.socket readDataWithTimeout:-1 tag:0];
+        return;
+    }
+    
     NSString *response = [[NSString alloc] initWithData:data encoding:NSUTF8StringEncoding];
     NSLog(@"Received response: %@", response);
     
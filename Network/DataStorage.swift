@@ -13,7 +13,10 @@ class DataStorage {
     static let shared = DataStorage()
     
     let socketManager = SocketManager()
-    let compressionQuality: CGFloat = 0.4
+    // Adjusted at runtime from the flow-control feedback of the server
+    var compressionQuality: CGFloat = 0.4
+    var targetFrameRate: Double = 30
+    private var nextFrameDeadline: TimeInterval = 0
     var readyToSend: Bool = false
     
     private(set) var currentHostIP = "10.129.164.22"
@@ -27,6 +30,11 @@ class DataStorage {
         if UserDefaults.standard.object(forKey: "currentPort") != nil {
             currentPort = UserDefaults.standard.integer(forKey: "currentPort")
         }
+        socketManager.feedbackHandler = { [weak self] feedback in
+            guard let self = self else { return }
+            self.compressionQuality = CGFloat(feedback.jpegQuality)
+            self.targetFrameRate = max(1, feedback.frameRate)
+        }
         socketManager.connectToServer(host_ip: currentHostIP, port: currentPort) { success in
             if success {
                 DispatchQueue.main.asyncAfter(deadline: .now() + 0.2) {
@@ -144,6 +152,16 @@ class DataStorage {
             return
         }
         
+        // Skip frames to stay below the frame rate suggested by the server. Frames
+        // are scheduled against a deadline with half an interval of tolerance, so
+        // camera jitter does not drop frames when the camera runs at the target rate
+        let now = Date().timeIntervalSince1970
+        let interval = 1.0 / targetFrameRate
+        if now < nextFrameDeadline - interval / 2 {
+            return
+        }
+        nextFrameDeadline = max(nextFrameDeadline + interval, now)
+        
         let ciImage = CIImage(cvImageBuffer: imageData)
         let context = CIContext(options: nil)
         guard let cgImage = context.createCGImage(ciImage, from: ciImage.extent) else {
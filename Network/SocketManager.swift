@@ -13,6 +13,7 @@ enum DataType: UInt8 {
     case jpg = 0x01
     case bin = 0x02
     case csv = 0x03
+    case imu = 0x04 // batch of IMU samples, 11 little-endian Float64 per sample
 }
 
 /*
@@ -27,8 +28,37 @@ enum DataType: UInt8 {
  [Is last chunk] 1 byte UInt8
  
  In [Payload] is Binary data
+ 
+ Server acknowledgment (coalesced, sent at most every 100 ms):
+ [Magic] 1 byte 0xAC
+ [Version] 1 byte
+ [Completed files] 2 bytes UInt16 big-endian
+ [Queue depth] 2 bytes UInt16 big-endian
+ [Drop rate] 2 bytes UInt16 big-endian, per mille
+ [Suggested JPEG quality] 1 byte UInt8, percent
+ [Suggested frame rate] 1 byte UInt8, fps
  */
 
+struct ServerFeedback {
+    static let size = 10
+    static let magic: UInt8 = 0xAC
+    
+    let completedFiles: Int
+    let queueDepth: Int
+    let dropRate: Double
+    let jpegQuality: Double
+    let frameRate: Double
+    
+    init?(bytes: [UInt8]) {
+        guard bytes.count == ServerFeedback.size, bytes[0] == ServerFeedback.magic, bytes[1] == 1 else { return nil }
+        completedFiles = Int(bytes[2]) << 8 | Int(bytes[3])
+        queueDepth = Int(bytes[4]) << 8 | Int(bytes[5])
+        dropRate = Double(Int(bytes[6]) << 8 | Int(bytes[7])) / 1000.0
+        jpegQuality = Double(bytes[8]) / 100.0
+        frameRate = Double(bytes[9])
+    }
+}
+
 struct DataPacket {
     let dataType: DataType
     let fileName: String
@@ -69,12 +99,32 @@ struct DataPacket {
 
 class SocketManager {
     let socketHandler = CocoaAsyncSocketHandler()
+    var feedbackHandler: ((ServerFeedback) -> Void)?
+    private var ackBuffer = [UInt8]()
 
     init() {
         // Configure response handling closure
         socketHandler.getResponseBlock = { response in
             print("Received server response: \(response)")
         }
+        socketHandler.getDataBlock = { [weak self] data in
+            self?.handleAcknowledgments(data)
+        }
+    }
+    
+    private func handleAcknowledgments(_ data: Data) {
+        // TCP may split or merge acknowledgments, so parse fixed-size records from a buffer
+        ackBuffer.append(contentsOf: data)
+        while ackBuffer.count >= ServerFeedback.size {
+            let record = Array(ackBuffer.prefix(ServerFeedback.size))
+            guard let feedback = ServerFeedback(bytes: record) else {
+                // Out of sync; drop one byte and look for the next magic byte
+                ackBuffer.removeFirst()
+                continue
+            }
+            ackBuffer.removeFirst(ServerFeedback.size)
+            feedbackHandler?(feedback)
+        }
     }
     
     func connectToServer(host_ip: String, port: Int, completion: @escaping (Bool) -> Void) {
@@ -121,4 +171,8 @@ class SocketManager {
     func sendCSV(fileName: String, data: Data, chunkSize: Int = 1024) {
         sendData(dataType: .csv, fileName: fileName, data: data, chunkSize: chunkSize)
     }
+    
+    func sendIMU(fileName: String, data: Data, chunkSize: Int = 1024) {
+        sendData(dataType: .imu, fileName: fileName, data: data, chunkSize: chunkSize)
+    }
 }
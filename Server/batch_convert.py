@@ -0,0 +1,246 @@
+# =========================
+# iLiDAR
+# batch_convert.py
+# =========================
+
+import argparse
+import concurrent.futures
+import csv
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from read_depth_data import read_raw_depth_data, depth_to_points
+from timing import FRAME_TIMESTAMP_PATTERN, parse_frame_timestamp
+
+# =========================
+# Configuration Parameters
+# =========================
+
+DEPTH_WIDTH = 320
+DEPTH_HEIGHT = 240
+
+# The calibration CSV holds intrinsics for the camera reference resolution;
+# they are scaled by DEPTH_WIDTH / REFERENCE_WIDTH for the depth map
+REFERENCE_WIDTH = 1920
+
+PROGRESS_INTERVAL = 2.0  # Seconds between progress reports
+
+# =========================
+# Helper Classes and Methods
+# =========================
+
+def event_of(filename):
+    """
+    Returns the event timestamp prefix (yyyyMMdd_HHmmss) of a frame filename,
+    or None if the name is not a frame name.
+    """
+    if FRAME_TIMESTAMP_PATTERN.match(filename) is None:
+        return None
+    return filename[:15]  # yyyyMMdd_HHmmss
+
+
+def find_frames(input_path):
+    """
+    Groups the depth frames below input_path by event.
+
+    input_path may be an event folder, a session folder with event folders
+    (as written by utils.classification_by_event) or a flat uploads folder.
+    The server stores sessions as folders of files, so there is no session
+    file to read. .bin files whose names are not frame names are skipped.
+
+    Returns:
+    - events: dict, maps (folder, event) to a sorted list of frame names without extension
+    """
+    events = {}
+    skipped = 0
+    for folder, _, files in os.walk(input_path):
+        for file in files:
+            if file.endswith('.bin'):
+                name = file[:-len('.bin')]
+                event = event_of(name)
+                if event is None:
+                    skipped += 1
+                    continue
+                events.setdefault((folder, event), []).append(name)
+    if skipped:
+        print(f"[!] Skipping {skipped} .bin files that are not named like recorded frames.")
+    for frames in events.values():
+        frames.sort()
+    return events
+
+
+def load_calibration(folder, event, reference_width, depth_width):
+    """
+    Reads the [event].csv camera parameters and scales them to the depth resolution.
+
+    Returns:
+    - intrinsics: tuple of float (fx, fy, cx, cy), or None if the file is missing
+    """
+    path = os.path.join(folder, event + '.csv')
+    if not os.path.exists(path):
+        return None
+    with open(path, newline='') as f:
+        row = next(csv.DictReader(f))
+    scale = depth_width / reference_width
+    return tuple(float(row[key]) * scale for key in ('fx', 'fy', 'cx', 'cy'))
+
+
+def write_ply(path, points, colors=None):
+    """
+    Writes a binary little-endian PLY point cloud, with per-point colors if given.
+    """
+    fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    if colors is not None:
+        fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    vertices = np.empty(len(points), dtype=fields)
+    vertices['x'], vertices['y'], vertices['z'] = points[:, 0], points[:, 1], points[:, 2]
+    if colors is not None:
+        vertices['red'], vertices['green'], vertices['blue'] = colors[:, 0], colors[:, 1], colors[:, 2]
+
+    properties = ''.join(f"property {'float' if dtype == '<f4' else 'uchar'} {name}\n" for name, dtype in fields)
+    header = ("ply\nformat binary_little_endian 1.0\n"
+              f"element vertex {len(points)}\n{properties}end_header\n")
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        f.write(vertices.tobytes())
+
+
+def output_paths(output_folder, name, output_format, rgbd):
+    paths = [os.path.join(output_folder, name + '.' + output_format)]
+    if rgbd:
+        paths.append(os.path.join(output_folder, name + '_rgbd.npz'))
+    return paths
+
+
+def convert_frame(folder, name, output_folder, intrinsics, output_format, rgbd, depth_width, depth_height):
+    """
+    Converts one frame; runs in a worker process.
+
+    Outputs are written under a temporary name and renamed when complete, so
+    an interrupted run never leaves a partial file that would be skipped on
+    resume.
+
+    Returns:
+    - num_points: int, number of valid depth points
+    """
+    depth_data = read_raw_depth_data(os.path.join(folder, name + '.bin'), depth_width, depth_height)
+    fx, fy, cx, cy = intrinsics
+    points = depth_to_points(depth_data, fx, fy, cx, cy)
+
+    color = None
+    color_path = os.path.join(folder, name + '.jpg')
+    if os.path.exists(color_path):
+        # Resample the color image to the depth grid so pixels line up
+        with Image.open(color_path) as image:
+            # Let the JPEG decoder downscale in the DCT domain first, far cheaper than a full decode
+            image.draft('RGB', (depth_width, depth_height))
+            color = np.asarray(image.convert('RGB').resize((depth_width, depth_height), Image.BILINEAR))
+
+    depth = depth_data.astype(np.float32)
+    valid = np.isfinite(depth) & (depth > 0)
+    point_colors = color[valid] if color is not None else None
+
+    cloud_path, *rgbd_path = output_paths(output_folder, name, output_format, rgbd)
+    temporary = cloud_path + '.tmp'
+    if output_format == 'ply':
+        write_ply(temporary, points, point_colors)
+    else:
+        arrays = {'points': points}
+        if point_colors is not None:
+            arrays['colors'] = point_colors
+        with open(temporary, 'wb') as f:
+            np.savez(f, **arrays)
+    os.replace(temporary, cloud_path)
+
+    if rgbd_path and color is not None:
+        timestamp = parse_frame_timestamp(name)
+        temporary = rgbd_path[0] + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez(f, color=color, depth=depth, intrinsics=np.array(intrinsics, dtype=np.float32),
+                     timestamp=np.nan if timestamp is None else timestamp)
+        os.replace(temporary, rgbd_path[0])
+    return len(points)
+
+
+def convert(input_path, output_path, output_format='ply', rgbd=False, workers=None, max_pending=None,
+            reference_width=REFERENCE_WIDTH, depth_width=DEPTH_WIDTH, depth_height=DEPTH_HEIGHT):
+    """
+    Converts every recorded frame below input_path with a process pool.
+
+    At most max_pending frames are in flight at any time, so memory stays
+    bounded however long the session is. Frames whose outputs already exist
+    are skipped, which makes an interrupted run resumable.
+    """
+    workers = workers or os.cpu_count()
+    max_pending = max_pending or 4 * workers
+
+    jobs = []
+    for (folder, event), frames in sorted(find_frames(input_path).items()):
+        intrinsics = load_calibration(folder, event, reference_width, depth_width)
+        if intrinsics is None:
+            print(f"[!] No camera parameters {event}.csv in {folder}, skipping {len(frames)} frames.")
+            continue
+        output_folder = os.path.join(output_path, event)
+        os.makedirs(output_folder, exist_ok=True)
+        for name in frames:
+            # RGB-D pairs need the color image; without it only the point cloud is expected
+            frame_rgbd = rgbd and os.path.exists(os.path.join(folder, name + '.jpg'))
+            if all(os.path.exists(p) for p in output_paths(output_folder, name, output_format, frame_rgbd)):
+                continue
+            jobs.append((folder, name, output_folder, intrinsics, frame_rgbd))
+
+    total = len(jobs)
+    print(f"[*] Converting {total} frames with {workers} workers.")
+    start = last_report = time.time()
+    done = failed = 0
+    pending = set()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = iter(jobs)
+        while True:
+            for folder, name, output_folder, intrinsics, frame_rgbd in jobs:
+                pending.add(executor.submit(convert_frame, folder, name, output_folder, intrinsics,
+                                            output_format, frame_rgbd, depth_width, depth_height))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    future.result()
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    print(f"[!] Failed to convert a frame: {e}")
+
+            now = time.time()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                print(f"[~] {done}/{total} frames, {done / (now - start):.1f} frames/s")
+
+    elapsed = time.time() - start
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"[+] Converted {done} frames ({failed} failed) in {elapsed:.1f} s, {rate:.1f} frames/s.")
+    return done, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert recorded iLiDAR sessions to point clouds and RGB-D pairs.")
+    parser.add_argument('input', help="event folder, session folder or flat uploads folder")
+    parser.add_argument('output', help="output folder, one subfolder per event")
+    parser.add_argument('--format', choices=('ply', 'npz'), default='ply', help="point cloud file format")
+    parser.add_argument('--rgbd', action='store_true', help="also write aligned color/depth pairs as [frame]_rgbd.npz")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--max-pending', type=int, default=None, help="frames in flight (default: 4 x workers)")
+    parser.add_argument('--reference-width', type=float, default=REFERENCE_WIDTH,
+                        help="image width the calibration CSV intrinsics refer to")
+    args = parser.parse_args()
+
+    convert(args.input, args.output, args.format, args.rgbd, args.workers, args.max_pending, args.reference_width)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# =========================
+# iLiDAR
+# flow_control.py
+# =========================
+
+import collections
+import socket
+import struct
+import threading
+
+# =========================
+# Configuration Parameters
+# =========================
+
+# Set to False to never write anything back to the phone
+ACK_ENABLED = True
+
+# Completed files are acknowledged at most once per window (seconds)
+ACK_INTERVAL = 0.1
+
+# Maximum number of completed frames waiting to be published per connection;
+# when full the oldest frame is dropped
+FRAME_QUEUE_SIZE = 8
+
+# Range and starting point of the sender settings suggested in acknowledgments
+JPEG_QUALITY_MIN = 0.1
+JPEG_QUALITY_MAX = 0.8
+JPEG_QUALITY_START = 0.4  # DataStorage.compressionQuality on the phone
+FRAME_RATE_MIN = 5.0
+FRAME_RATE_MAX = 30.0
+
+# Binary acknowledgment, big-endian like the packet header:
+# [magic] 1 byte 0xAC
+# [version] 1 byte
+# [completed files since the previous acknowledgment] 2 bytes
+# [publish queue depth] 2 bytes
+# [drop rate over the window] 2 bytes, per mille
+# [suggested JPEG quality] 1 byte, percent
+# [suggested frame rate] 1 byte, frames per second
+ACK_MAGIC = 0xAC
+ACK_VERSION = 1
+ACK_STRUCT = struct.Struct('>BBHHHBB')
+
+# =========================
+# Helper Classes and Methods
+# =========================
+
+Feedback = collections.namedtuple('Feedback', ['completed', 'queue_depth', 'drop_rate', 'jpeg_quality', 'frame_rate'])
+
+
+def pack_ack(feedback):
+    """
+    Encodes a Feedback tuple as a binary acknowledgment.
+    """
+    return ACK_STRUCT.pack(ACK_MAGIC, ACK_VERSION,
+                           min(feedback.completed, 0xFFFF),
+                           min(feedback.queue_depth, 0xFFFF),
+                           min(int(round(feedback.drop_rate * 1000)), 1000),
+                           int(round(feedback.jpeg_quality * 100)),
+                           int(round(feedback.frame_rate)))
+
+
+def unpack_ack(data):
+    """
+    Decodes a binary acknowledgment into a Feedback tuple.
+    """
+    magic, version, completed, queue_depth, drop_permille, quality, frame_rate = ACK_STRUCT.unpack(data)
+    if magic != ACK_MAGIC or version != ACK_VERSION:
+        raise ValueError(f"Not an acknowledgment (magic {magic:#x}, version {version}).")
+    return Feedback(completed, queue_depth, drop_permille / 1000.0, quality / 100.0, float(frame_rate))
+
+
+class PublishQueue:
+    """
+    Bounded queue of publish jobs served by a worker thread, so the socket
+    reader never waits on message conversion or publishing. When the worker
+    falls behind the oldest job is dropped: a stale frame is worth less than
+    a fresh one.
+    """
+    def __init__(self, maxsize=FRAME_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.jobs = collections.deque()
+        self.condition = threading.Condition()
+        self.enqueued = 0  # Totals since start, read by the acknowledgment writer
+        self.dropped = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def put(self, job):
+        """
+        Queues a callable; returns False if an older job had to be dropped.
+        """
+        with self.condition:
+            dropped = len(self.jobs) >= self.maxsize
+            if dropped:
+                self.jobs.popleft()
+                self.dropped += 1
+            self.jobs.append(job)
+            self.enqueued += 1
+            self.condition.notify()
+        return not dropped
+
+    def depth(self):
+        return len(self.jobs)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def worker(self):
+        while True:
+            with self.condition:
+                while self.running and not self.jobs:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                job = self.jobs.popleft()
+            try:
+                job()
+            except Exception as e:
+                print(f"[!] Failed to publish: {e}")
+
+
+class RateAdvisor:
+    """
+    Suggests a JPEG quality and frame rate for the sender with an AIMD rule:
+    back off multiplicatively as soon as frames are dropped or the queue is
+    half full, and probe upwards slowly while the queue stays empty.
+    """
+    def __init__(self):
+        self.jpeg_quality = JPEG_QUALITY_START
+        self.frame_rate = FRAME_RATE_MAX
+
+    def update(self, queue_depth, queue_capacity, drop_rate):
+        if drop_rate > 0 or queue_depth * 2 >= queue_capacity:
+            self.frame_rate = max(FRAME_RATE_MIN, self.frame_rate * 0.8)
+            self.jpeg_quality = max(JPEG_QUALITY_MIN, self.jpeg_quality * 0.9)
+        elif queue_depth == 0:
+            self.frame_rate = min(FRAME_RATE_MAX, self.frame_rate + 0.5)
+            self.jpeg_quality = min(JPEG_QUALITY_MAX, self.jpeg_quality + 0.01)
+        return self.jpeg_quality, self.frame_rate
+
+
+class AckWriter(threading.Thread):
+    """
+    Sends coalesced binary acknowledgments to one client from its own thread.
+
+    The reader only increments a counter; at most once per ACK_INTERVAL this
+    thread packs the count together with the flow-control feedback and writes
+    it, so a slow receive side on the phone can only stall this thread.
+    """
+    def __init__(self, client_socket, client_address, publish_queue, interval=ACK_INTERVAL):
+        super().__init__(daemon=True)
+        self.client_socket = client_socket
+        self.client_address = client_address
+        self.publish_queue = publish_queue
+        self.interval = interval
+        self.advisor = RateAdvisor()
+        self.completed = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.last_enqueued = 0
+        self.last_dropped = 0
+
+    def acknowledge(self):
+        """
+        Records one completed file; called from the reader thread.
+        """
+        with self.lock:
+            self.completed += 1
+
+    def stop(self):
+        self.stopped.set()
+
+    def feedback(self):
+        """
+        Collects the feedback for the current window and resets the counters.
+        """
+        with self.lock:
+            completed, self.completed = self.completed, 0
+        enqueued = self.publish_queue.enqueued
+        dropped = self.publish_queue.dropped
+        window_enqueued = enqueued - self.last_enqueued
+        drop_rate = (dropped - self.last_dropped) / window_enqueued if window_enqueued else 0.0
+        self.last_enqueued, self.last_dropped = enqueued, dropped
+
+        queue_depth = self.publish_queue.depth()
+        jpeg_quality, frame_rate = self.advisor.update(queue_depth, self.publish_queue.maxsize, drop_rate)
+        return Feedback(completed, queue_depth, drop_rate, jpeg_quality, frame_rate)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            feedback = self.feedback()
+            if feedback.completed == 0:
+                continue
+            try:
+                self.client_socket.sendall(pack_ack(feedback))
+            except (socket.error, ValueError) as e:
+                print(f"[!] Failed to send acknowledgment to {self.client_address}: {e}")
+                return
@@ -5,14 +5,21 @@
 # =========================
 
 
+import functools
 import socket
 import threading
 import struct
 import os
+import time
+import queue
 import rclpy
 from rclpy.node import Node
 from sensor_msgs.msg import CompressedImage
 from sensor_msgs.msg import Imu
+from read_imu_data import parse_imu_binary, parse_imu_csv, STANDARD_GRAVITY
+from timing import StreamClock, to_stamp
+from flow_control import ACK_ENABLED, AckWriter, PublishQueue
+from profiling import PROFILER, install_signal_handlers
 
 # =========================
 # Configuration Parameters
@@ -22,14 +29,22 @@ from sensor_msgs.msg import Imu
 DATA_TYPE_JPEG = 0x01
 DATA_TYPE_BIN = 0x02
 DATA_TYPE_CSV = 0x03
+DATA_TYPE_IMU = 0x04  # Batch of packed IMU samples, see read_imu_data.py
 
 # Mapping from data type to file extension
 DATA_TYPE_EXTENSION = {
     DATA_TYPE_JPEG: '.jpg',
     DATA_TYPE_BIN: '.bin',
-    DATA_TYPE_CSV: '.csv'
+    DATA_TYPE_CSV: '.csv',
+    DATA_TYPE_IMU: '.imu'
 }
 
+# IMU batches are named imu_[event]; other CSV files carry camera parameters
+IMU_FILENAME_PREFIX = 'imu_'
+
+# Maximum number of IMU batches waiting to be published before new ones are dropped
+IMU_QUEUE_SIZE = 64
+
 # Server details
 SERVER_HOST = '0.0.0.0'  # Listen on all available interfaces
 SERVER_PORT = 5678        # Port to listen on
@@ -86,32 +101,78 @@ class iOSDataPublisher(Node):
         self.img_publisher_ = self.create_publisher(CompressedImage, '/color_image', 10)
         self.imu_publisher_ = self.create_publisher(Imu, '/imu', 10)
 
-    def x(self, jpeg_data, frame_id='color_image'):
+        # IMU batches are published from their own thread so that expanding
+        # hundreds of samples into messages never delays the socket reader
+        self.imu_queue = queue.Queue(maxsize=IMU_QUEUE_SIZE)
+        self.imu_thread = threading.Thread(target=self.imu_worker, daemon=True)
+        self.imu_thread.start()
+
+    def stamp_or_now(self, stamp):
+        """
+        Returns the header stamp for a capture time in host seconds, falling back to the current time.
+        """
+        if stamp is None:
+            return self.get_clock().now().to_msg()
+        return to_stamp(stamp)
+
+    def publish_jpeg(self, jpeg_data, frame_id='color_image', stamp=None):
         msg = CompressedImage()
-        msg.header.stamp = self.get_clock().now().to_msg()
+        msg.header.stamp = self.stamp_or_now(stamp)
         msg.header.frame_id = frame_id
         msg.format = 'jpeg'
         msg.data = jpeg_data
-        self.img_publisher_.publish(msg)
+        with PROFILER.span('publish'):
+            self.img_publisher_.publish(msg)
 
-    def publish_imu(self, imu_data):
+    def publish_imu(self, sample, stamp=None):
+        """
+        Publishes a single IMU sample.
+
+        Parameters:
+        - sample: sequence of float, one row in the read_imu_data.IMU_COLUMNS layout
+        - stamp: float, sample time in host seconds; the current time is used if None
+        """
         msg = Imu()
-        msg.header.stamp = self.get_clock().now().to_msg()
+        msg.header.stamp = self.stamp_or_now(stamp)
         msg.header.frame_id = "imu"
-        msg.orientation.x = 0.0
-        msg.orientation.y = 0.0
-        msg.orientation.z = 0.0
-        msg.orientation.w = 0.0
-
-        msg.angular_velocity.x = 0.0
-        msg.angular_velocity.y = 0.0
-        msg.angular_velocity.z = 0.0
-
-        msg.linear_acceleration.x = 0.0
-        msg.linear_acceleration.y = 0.0
-        msg.linear_acceleration.z = 0.0
+        msg.orientation.x = sample[1]
+        msg.orientation.y = sample[2]
+        msg.orientation.z = sample[3]
+        msg.orientation.w = sample[4]
+
+        msg.angular_velocity.x = sample[5]
+        msg.angular_velocity.y = sample[6]
+        msg.angular_velocity.z = sample[7]
+
+        # CoreMotion reports acceleration in g with gravity pointing along -z when
+        # lying face up; REP-145 expects m/s^2 reading +9.81 upwards at rest
+        msg.linear_acceleration.x = -sample[8] * STANDARD_GRAVITY
+        msg.linear_acceleration.y = -sample[9] * STANDARD_GRAVITY
+        msg.linear_acceleration.z = -sample[10] * STANDARD_GRAVITY
         self.imu_publisher_.publish(msg)
 
+    def enqueue_imu(self, samples, stamps, stream_clock):
+        """
+        Queues a parsed IMU batch for publishing, one message per sample.
+        """
+        try:
+            self.imu_queue.put_nowait((samples, stamps, stream_clock))
+        except queue.Full:
+            print(f"[!] IMU queue full, dropping batch of {len(samples)} samples.")
+
+    def imu_worker(self):
+        while True:
+            samples, stamps, stream_clock = self.imu_queue.get()
+            try:
+                # tolist() converts the whole batch to Python floats at once
+                with PROFILER.span('publish_imu_batch'):
+                    for sample, stamp in zip(samples.tolist(), stamps.tolist()):
+                        self.publish_imu(sample, stamp)
+                # The newest sample measures link and pipeline delay without the batching delay
+                stream_clock.record_publish('/imu', stamps[-1])
+            except Exception as e:
+                print(f"[!] Failed to publish IMU batch: {e}")
+
 class ClientHandler(threading.Thread):
     """
     Handles communication with a single client.
@@ -123,9 +184,14 @@ class ClientHandler(threading.Thread):
         self.buffer = b''  # Buffer to store incoming data
         self.files = {}     # Maps filename to FileReceiver instances
         self.ios_data_publisher = ios_data_publisher
+        self.stream_clock = StreamClock()  # Capture time correction and latency stats
+        self.publish_queue = PublishQueue()  # Decouples publishing from the socket reader
+        self.ack_writer = AckWriter(client_socket, client_address, self.publish_queue) if ACK_ENABLED else None
 
     def run(self):
         print(f"[+] Connection established with {self.client_address}")
+        if self.ack_writer is not None:
+            self.ack_writer.start()
         try:
             while True:
                 data = self.client_socket.recv(4096)
@@ -133,10 +199,14 @@ class ClientHandler(threading.Thread):
                     print(f"[-] Connection closed by {self.client_address}")
                     break
                 self.buffer += data
-                self.process_buffer()
+                with PROFILER.span('process_buffer'):
+                    self.process_buffer()
         except Exception as e:
             print(f"[!] Error with client {self.client_address}: {e}")
         finally:
+            if self.ack_writer is not None:
+                self.ack_writer.stop()
+            self.publish_queue.stop()
             self.client_socket.close()
 
     def process_buffer(self):
@@ -210,8 +280,10 @@ class ClientHandler(threading.Thread):
         # Map data type to string for logging
         data_type_str = DATA_TYPE_EXTENSION.get(data_type, f'Unknown({data_type})')
 
-        print(f"[>] Received Packet - Filename: {filename}, Type: {data_type_str}, "
-              f"Seq: {sequence_number}, IsLast: {is_last}, Size: {data_size} bytes")
+        # IMU batches arrive ~20 times per second, don't log every packet
+        if data_type != DATA_TYPE_IMU:
+            print(f"[>] Received Packet - Filename: {filename}, Type: {data_type_str}, "
+                  f"Seq: {sequence_number}, IsLast: {is_last}, Size: {data_size} bytes")
 
         # Initialize FileReceiver if it's the first chunk of the file
         if filename not in self.files:
@@ -221,45 +293,53 @@ class ClientHandler(threading.Thread):
             self.files[filename] = FileReceiver(filename, data_type)
 
         file_receiver = self.files[filename]
-        file_receiver.add_chunk(sequence_number, payload, is_last)
+        with PROFILER.span('reassembly'):
+            file_receiver.add_chunk(sequence_number, payload, is_last)
+            is_complete = file_receiver.is_complete()
 
         # Check if the file is fully received
-        if file_receiver.is_complete():
-            complete_data = file_receiver.reconstruct_file()
+        if is_complete:
+            with PROFILER.span('reassembly'):
+                complete_data = file_receiver.reconstruct_file()
+            arrival_time = time.time()
+            capture_time = self.stream_clock.capture_time(filename, arrival_time)
             if file_receiver.data_type == DATA_TYPE_JPEG:
-                # Publish JPEG to ROS 2 topic
-                self.ios_data_publisher.publish_jpeg(complete_data)
-                print(f"[+] JPEG published to /color_image")
-            elif file_receiver.data_type == DATA_TYPE_CSV:
-                self.ios_data_publisher.publish_imu(complete_data)
-                # Debugging: print IMU CSV data
-                print(f"[DEBUG] IMU CSV file received: {filename}")
-                try:
-                    csv_text = complete_data.decode('utf-8', errors='replace')
-                    lines = csv_text.splitlines()
-                    print(f"[DEBUG] First 5 lines of IMU CSV data:")
-                    for line in lines[:5]:
-                        print(f"    {line}")
-                except Exception as e:
-                    print(f"[DEBUG] Failed to decode IMU CSV data: {e}")
+                # Publish JPEG to ROS 2 topic from the publish queue
+                self.publish_queue.put(functools.partial(self.publish_jpeg, complete_data, capture_time))
+            elif file_receiver.data_type == DATA_TYPE_IMU or (
+                    file_receiver.data_type == DATA_TYPE_CSV and filename.startswith(IMU_FILENAME_PREFIX)):
+                self.handle_imu(filename, file_receiver.data_type, complete_data, arrival_time)
             else:
                 # Optionally handle other types as before, or ignore
                 pass
-            ack_message = f"File '{filename}' received and processed successfully."
-            self.send_acknowledgment(ack_message)
+            if self.ack_writer is not None:
+                self.ack_writer.acknowledge()
 
             # Remove the FileReceiver instance as it's no longer needed
             del self.files[filename]
 
-    def send_acknowledgment(self, message):
+    def publish_jpeg(self, jpeg_data, capture_time):
+        self.ios_data_publisher.publish_jpeg(jpeg_data, stamp=capture_time)
+        self.stream_clock.record_publish('/color_image', capture_time)
+        print(f"[+] JPEG published to /color_image")
+
+    def handle_imu(self, filename, data_type, data, arrival_time):
         """
-        Sends an acknowledgment message back to the client.
+        Parses an IMU batch and hands it to the publisher thread.
         """
         try:
-            self.client_socket.sendall(message.encode('utf-8'))
-            print(f"[<] Sent acknowledgment to {self.client_address}: {message}")
-        except Exception as e:
-            print(f"[!] Failed to send acknowledgment to {self.client_address}: {e}")
+            with PROFILER.span('numpy_conversion'):
+                if data_type == DATA_TYPE_IMU:
+                    samples = parse_imu_binary(data)
+                else:
+                    samples = parse_imu_csv(data)
+        except ValueError as e:
+            print(f"[!] Failed to parse IMU data {filename}: {e}")
+            return
+        if len(samples) == 0:
+            return
+        stamps = self.stream_clock.imu_times(samples[:, 0], arrival_time)
+        self.ios_data_publisher.enqueue_imu(samples, stamps, self.stream_clock)
 
 # =========================
 # Server Setup and Execution
@@ -287,6 +367,8 @@ def start_server(ios_data_publisher):
         server_socket.close()
 
 def main():
+    # Before rclpy.init() so that every thread started afterwards inherits the signal mask
+    install_signal_handlers()
     rclpy.init()
     ios_data_publisher = iOSDataPublisher()
     server_thread = threading.Thread(target=start_server, args=(ios_data_publisher,), daemon=True)
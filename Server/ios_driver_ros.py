@@ -5,16 +5,22 @@
 # =========================
 
 
+import functools
 import socket
 import threading
 import struct
 import os
+import time
 import rclpy
 from rclpy.node import Node
 from sensor_msgs.msg import CompressedImage, PointCloud2, PointField
 from rclpy.qos import QoSProfile, QoSReliabilityPolicy, QoSHistoryPolicy
 import numpy as np
-from read_depth_data import read_raw_depth_data
+from read_depth_data import read_raw_depth_data, depth_to_points
+from voxel_map import VoxelMap
+from timing import LatencyTracker, StreamClock, LATENCY_REPORT_INTERVAL, to_stamp
+from flow_control import ACK_ENABLED, AckWriter, PublishQueue
+from profiling import PROFILER, install_signal_handlers
 import queue
 
 # =========================
@@ -25,12 +31,14 @@ import queue
 DATA_TYPE_JPEG = 0x01
 DATA_TYPE_BIN = 0x02
 DATA_TYPE_CSV = 0x03
+DATA_TYPE_IMU = 0x04  # Batch of packed IMU samples, published by ios_driver.py only
 
 # Mapping from data type to file extension
 DATA_TYPE_EXTENSION = {
     DATA_TYPE_JPEG: '.jpg',
     DATA_TYPE_BIN: '.bin',
-    DATA_TYPE_CSV: '.csv'
+    DATA_TYPE_CSV: '.csv',
+    DATA_TYPE_IMU: '.imu'
 }
 
 # Server details
@@ -39,6 +47,10 @@ SERVER_PORT = 5678        # Port to listen on
 
 SAVE_DIRECTORY = 'uploads'  # Directory to save uploaded files
 
+# Optional height map / occupancy stage fed from the depth stream
+MAP_ENABLED = False
+MAP_PUBLISH_RATE = 2.0  # Hz, changed cells are accumulated in between
+
 # Create the uploads directory if it doesn't exist
 os.makedirs(SAVE_DIRECTORY, exist_ok=True)
 
@@ -96,9 +108,9 @@ class ImagePublisher(Node):
         super().__init__('image_publisher')
         self.publisher_ = self.create_publisher(CompressedImage, '/color_image/compressed', self.qos_profile)
 
-    def publish_jpeg(self, jpeg_data, frame_id='color_image'):
+    def publish_jpeg(self, jpeg_data, frame_id='color_image', stamp=None):
         msg = CompressedImage()
-        msg.header.stamp = self.get_clock().now().to_msg()
+        msg.header.stamp = self.get_clock().now().to_msg() if stamp is None else to_stamp(stamp)
         msg.header.frame_id = frame_id
         msg.format = 'jpeg'
         msg.data = jpeg_data
@@ -110,7 +122,7 @@ class PointCloudPublisher(Node):
         super().__init__('pointcloud_publisher')
         self.publisher_ = self.create_publisher(PointCloud2, '/depth_pointcloud', 10)
 
-    def publish_pointcloud(self, depth_data, width, height, fx, fy, cx, cy):
+    def publish_pointcloud(self, depth_data, width, height, fx, fy, cx, cy, stamp=None):
         """
         Converts depth data to a point cloud and publishes it.
 
@@ -119,21 +131,17 @@ class PointCloudPublisher(Node):
         - width, height: int, dimensions of the depth image
         - fx, fy: float, focal lengths of the camera
         - cx, cy: float, principal point offsets of the camera
-        """
-        points = []
+        - stamp: float, capture time in host seconds; the current time is used if None
 
-        for v in range(height):
-            for u in range(width):
-                z = depth_data[v, u]
-                if z == 0:  # Skip invalid depth values
-                    continue
-                x = (u - cx) * z / fx
-                y = (v - cy) * z / fy
-                points.append((x, y, z))
+        Returns:
+        - points: numpy.ndarray, (N, 3) float32 array of the published points
+        """
+        with PROFILER.span('numpy_conversion'):
+            points = depth_to_points(depth_data, fx, fy, cx, cy)
 
         # Create PointCloud2 message
         pointcloud_msg = PointCloud2()
-        pointcloud_msg.header.stamp = self.get_clock().now().to_msg()
+        pointcloud_msg.header.stamp = self.get_clock().now().to_msg() if stamp is None else to_stamp(stamp)
         pointcloud_msg.header.frame_id = 'camera_frame'
 
         # Define the fields of the point cloud
@@ -151,16 +159,90 @@ class PointCloudPublisher(Node):
         pointcloud_msg.is_dense = True
 
         # Pack the point data into a binary array
-        pointcloud_msg.data = struct.pack('<' + 'fff' * len(points), *np.array(points).flatten())
+        with PROFILER.span('numpy_conversion'):
+            pointcloud_msg.data = points.astype('<f4', copy=False).tobytes()
 
-        self.publisher_.publish(pointcloud_msg)
+        with PROFILER.span('publish'):
+            self.publisher_.publish(pointcloud_msg)
         self.get_logger().info(f"Published point cloud with {len(points)} points")
+        return points
+
+class MapPublisher(Node):
+    """
+    Fuses depth frames into a VoxelMap and publishes the height map cells that
+    changed, at most MAP_PUBLISH_RATE times per second.
+
+    Updates run on their own worker thread behind a one-slot PublishQueue, so
+    the map never holds up /depth_pointcloud: if the map falls behind, the
+    pending frame is replaced by the newest one.
+
+    Each cell is a point at (cell center x, top of the highest occupied voxel,
+    cell center z) in the camera frame with an extra 'occupancy' field
+    (1 occupied, -1 unknown / evicted, y is NaN then).
+    """
+
+    def __init__(self, publish_rate=MAP_PUBLISH_RATE):
+        super().__init__('map_publisher')
+        self.publisher_ = self.create_publisher(PointCloud2, '/height_map_updates', 10)
+        self.voxel_map = VoxelMap()
+        self.update_queue = PublishQueue(maxsize=1)  # Latest frame wins; one worker serves all connections
+        self.publish_interval = 1.0 / publish_rate
+        self.last_publish = 0.0
+        self.update_times = LatencyTracker('map', label='Update time')
+        self.last_report = time.time()
+
+    def add_points(self, points, stamp=None):
+        """
+        Queues a frame for the map worker; returns immediately.
+        """
+        self.update_queue.put(lambda: self.update(points, stamp))
+
+    def update(self, points, stamp=None):
+        with PROFILER.span('map_update'):
+            self.update_times.add(self.voxel_map.integrate(points))
+
+        now = time.time()
+        if now - self.last_publish >= self.publish_interval:
+            self.last_publish = now
+            self.publish_changes(stamp)
+        if now - self.last_report >= LATENCY_REPORT_INTERVAL:
+            self.last_report = now
+            self.update_times.report()
+            print(f"[~] Map holds {len(self.voxel_map)} voxels, "
+                  f"skipped {self.update_queue.dropped}/{self.update_queue.enqueued} frames")
+
+    def destroy_node(self):
+        self.update_queue.stop()
+        super().destroy_node()
+
+    def publish_changes(self, stamp=None):
+        cells = self.voxel_map.changes()
+        if len(cells) == 0:
+            return
+
+        msg = PointCloud2()
+        msg.header.stamp = self.get_clock().now().to_msg() if stamp is None else to_stamp(stamp)
+        msg.header.frame_id = 'camera_frame'
+        msg.fields = [
+            PointField(name='x', offset=0, datatype=PointField.FLOAT32, count=1),
+            PointField(name='y', offset=4, datatype=PointField.FLOAT32, count=1),
+            PointField(name='z', offset=8, datatype=PointField.FLOAT32, count=1),
+            PointField(name='occupancy', offset=12, datatype=PointField.FLOAT32, count=1),
+        ]
+        msg.is_bigendian = False
+        msg.point_step = 16
+        msg.row_step = msg.point_step * len(cells)
+        msg.height = 1
+        msg.width = len(cells)
+        msg.is_dense = False  # Evicted cells carry NaN heights
+        msg.data = cells.astype('<f4', copy=False).tobytes()
+        self.publisher_.publish(msg)
 
 class ClientHandler(threading.Thread):
     """
     Handles communication with a single client.
     """
-    def __init__(self, client_socket, client_address, image_publisher, pointcloud_publisher):
+    def __init__(self, client_socket, client_address, image_publisher, pointcloud_publisher, map_publisher=None):
         super().__init__(daemon=True)
         self.client_socket = client_socket
         self.client_address = client_address
@@ -168,9 +250,15 @@ class ClientHandler(threading.Thread):
         self.files = {}     # Maps filename to FileReceiver instances
         self.image_publisher = image_publisher
         self.pointcloud_publisher = pointcloud_publisher
+        self.map_publisher = map_publisher
+        self.stream_clock = StreamClock()  # Capture time correction and latency stats
+        self.publish_queue = PublishQueue()  # Decouples publishing from the socket reader
+        self.ack_writer = AckWriter(client_socket, client_address, self.publish_queue) if ACK_ENABLED else None
 
     def run(self):
         print(f"[+] Connection established with {self.client_address}")
+        if self.ack_writer is not None:
+            self.ack_writer.start()
         try:
             while True:
                 data = self.client_socket.recv(4096)
@@ -178,10 +266,14 @@ class ClientHandler(threading.Thread):
                     print(f"[-] Connection closed by {self.client_address}")
                     break
                 self.buffer += data
-                self.process_buffer()
+                with PROFILER.span('process_buffer'):
+                    self.process_buffer()
         except Exception as e:
             print(f"[!] Error with client {self.client_address}: {e}")
         finally:
+            if self.ack_writer is not None:
+                self.ack_writer.stop()
+            self.publish_queue.stop()
             self.client_socket.close()
 
     def process_buffer(self):
@@ -255,8 +347,11 @@ class ClientHandler(threading.Thread):
         # Map data type to string for logging
         data_type_str = DATA_TYPE_EXTENSION.get(data_type, f'Unknown({data_type})')
 
-        print(f"[>] Received Packet - Filename: {filename}, Type: {data_type_str}, "
-              f"Seq: {sequence_number}, IsLast: {is_last}, Size: {data_size} bytes")
+        # IMU batches arrive ~20 times per second; they are reassembled and
+        # acknowledged but not published here, so don't log every packet
+        if data_type != DATA_TYPE_IMU:
+            print(f"[>] Received Packet - Filename: {filename}, Type: {data_type_str}, "
+                  f"Seq: {sequence_number}, IsLast: {is_last}, Size: {data_size} bytes")
 
         # Initialize FileReceiver if it's the first chunk of the file
         if filename not in self.files:
@@ -266,11 +361,15 @@ class ClientHandler(threading.Thread):
             self.files[filename] = FileReceiver(filename, data_type)
 
         file_receiver = self.files[filename]
-        file_receiver.add_chunk(sequence_number, payload, is_last)
+        with PROFILER.span('reassembly'):
+            file_receiver.add_chunk(sequence_number, payload, is_last)
+            is_complete = file_receiver.is_complete()
 
         # Check if the file is fully received
-        if file_receiver.is_complete():
-            complete_data = file_receiver.reconstruct_file()
+        if is_complete:
+            with PROFILER.span('reassembly'):
+                complete_data = file_receiver.reconstruct_file()
+            capture_time = self.stream_clock.capture_time(filename, time.time())
 
             if file_receiver.data_type == DATA_TYPE_BIN:
                 depth_width = 320  # Example width
@@ -279,31 +378,29 @@ class ClientHandler(threading.Thread):
                 cx, cy = 317.22327, 239.91258  # Updated principal point offsets from camera params
 
                 # Directly process depth data from the complete payload
-                depth_data = np.frombuffer(complete_data, dtype=np.float16).reshape((depth_height, depth_width))
-                self.pointcloud_publisher.publish_pointcloud(depth_data, depth_width, depth_height, fx, fy, cx, cy)
-                print(f"[+] Point cloud published to /depth_pointcloud")
+                with PROFILER.span('numpy_conversion'):
+                    depth_data = np.frombuffer(complete_data, dtype=np.float16).reshape((depth_height, depth_width))
+                self.publish_queue.put(functools.partial(self.publish_pointcloud, depth_data, depth_width, depth_height,
+                                                         fx, fy, cx, cy, capture_time))
 
-            ack_message = f"File '{filename}' received and processed successfully."
-            self.send_acknowledgment(ack_message)
+            if self.ack_writer is not None:
+                self.ack_writer.acknowledge()
 
             # Remove the FileReceiver instance as it's no longer needed
             del self.files[filename]
 
-    def send_acknowledgment(self, message):
-        """
-        Sends an acknowledgment message back to the client.
-        """
-        try:
-            self.client_socket.sendall(message.encode('utf-8'))
-            print(f"[<] Sent acknowledgment to {self.client_address}: {message}")
-        except Exception as e:
-            print(f"[!] Failed to send acknowledgment to {self.client_address}: {e}")
+    def publish_pointcloud(self, depth_data, width, height, fx, fy, cx, cy, capture_time):
+        points = self.pointcloud_publisher.publish_pointcloud(depth_data, width, height, fx, fy, cx, cy, stamp=capture_time)
+        self.stream_clock.record_publish('/depth_pointcloud', capture_time)
+        print(f"[+] Point cloud published to /depth_pointcloud")
+        if self.map_publisher is not None:
+            self.map_publisher.add_points(points, stamp=capture_time)
 
 # =========================
 # Server Setup and Execution
 # =========================
 
-def start_server(image_publisher, pointcloud_publisher):
+def start_server(image_publisher, pointcloud_publisher, map_publisher=None):
     """
     Initializes and starts the server to listen for incoming connections.
     """
@@ -315,7 +412,7 @@ def start_server(image_publisher, pointcloud_publisher):
     try:
         while True:
             client_sock, client_addr = server_socket.accept()
-            handler = ClientHandler(client_sock, client_addr, image_publisher, pointcloud_publisher)
+            handler = ClientHandler(client_sock, client_addr, image_publisher, pointcloud_publisher, map_publisher)
             handler.start()
     except KeyboardInterrupt:
         print("\n[!] Server shutting down.")
@@ -325,11 +422,15 @@ def start_server(image_publisher, pointcloud_publisher):
         server_socket.close()
 
 def main():
+    # Before rclpy.init() so that every thread started afterwards inherits the signal mask
+    install_signal_handlers()
     rclpy.init()
     image_publisher = ImagePublisher()
     pointcloud_publisher = PointCloudPublisher()
+    map_publisher = MapPublisher() if MAP_ENABLED else None
 
-    server_thread = threading.Thread(target=start_server, args=(image_publisher, pointcloud_publisher), daemon=True)
+    server_thread = threading.Thread(target=start_server, args=(image_publisher, pointcloud_publisher, map_publisher),
+                                     daemon=True)
     server_thread.start()
 
     try:
@@ -339,6 +440,8 @@ def main():
     finally:
         image_publisher.destroy_node()
         pointcloud_publisher.destroy_node()
+        if map_publisher is not None:
+            map_publisher.destroy_node()
         rclpy.shutdown()
 
 if __name__ == '__main__':
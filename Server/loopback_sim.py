@@ -0,0 +1,146 @@
+# =========================
+# iLiDAR
+# loopback_sim.py
+# =========================
+
+import argparse
+import io
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+
+from flow_control import ACK_STRUCT, unpack_ack
+
+# Same framing as SocketManager.swift on the phone
+DATA_TYPE_JPEG = 0x01
+DATA_TYPE_BIN = 0x02
+CHUNK_SIZE = 1024
+
+
+def build_packets(filename, data_type, data, chunk_size=CHUNK_SIZE):
+    """
+    Splits a file into protocol packets exactly like SocketManager.sendData.
+    """
+    name = filename.encode('utf-8')
+    packets = []
+    offsets = range(0, len(data), chunk_size)
+    for sequence_number, offset in enumerate(offsets):
+        chunk = data[offset:offset + chunk_size]
+        is_last = offset + chunk_size >= len(data)
+        header = bytes([len(name)]) + name + bytes([data_type]) + struct.pack('>II', len(chunk), sequence_number) + bytes([is_last])
+        packets.append(header + chunk)
+    return b''.join(packets)
+
+
+class PhoneSimulator:
+    """
+    Streams the example RGB-D frame to a running server over TCP, reads the
+    binary acknowledgments and, if adaptive, follows the suggested frame rate
+    and JPEG quality the way the app does.
+    """
+    def __init__(self, host, port, frame_rate, adaptive, depth_path, color_path):
+        self.host = host
+        self.port = port
+        self.frame_rate = frame_rate
+        self.jpeg_quality = 0.4
+        self.adaptive = adaptive
+        with open(depth_path, 'rb') as f:
+            self.depth_data = f.read()
+        with open(color_path, 'rb') as f:
+            self.color_data = f.read()
+        self.encoded = {}  # Maps JPEG quality percent to encoded image
+        self.acks = 0
+        self.acked_files = 0
+        self.last_feedback = None
+        self.lock = threading.Lock()
+
+    def jpeg_at_quality(self):
+        """
+        Returns the example image re-encoded at the current quality (requires Pillow).
+        """
+        percent = int(round(self.jpeg_quality * 100))
+        if percent not in self.encoded:
+            try:
+                from PIL import Image
+            except ImportError:
+                return self.color_data
+            buffer = io.BytesIO()
+            Image.open(io.BytesIO(self.color_data)).save(buffer, format='JPEG', quality=max(1, percent))
+            self.encoded[percent] = buffer.getvalue()
+        return self.encoded[percent]
+
+    def read_acks(self, sock):
+        buffer = b''
+        while True:
+            try:
+                data = sock.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while len(buffer) >= ACK_STRUCT.size:
+                feedback = unpack_ack(buffer[:ACK_STRUCT.size])
+                buffer = buffer[ACK_STRUCT.size:]
+                with self.lock:
+                    self.acks += 1
+                    self.acked_files += feedback.completed
+                    self.last_feedback = feedback
+                    if self.adaptive:
+                        self.frame_rate = feedback.frame_rate
+                        self.jpeg_quality = feedback.jpeg_quality
+
+    def run(self, duration):
+        event = datetime.now().strftime('%Y%m%d_%H%M%S')
+        sock = socket.create_connection((self.host, self.port))
+        threading.Thread(target=self.read_acks, args=(sock,), daemon=True).start()
+
+        start = time.time()
+        next_frame = start
+        next_report = start + 1.0
+        frames = sent_bytes = 0
+        try:
+            while time.time() - start < duration:
+                now = time.time()
+                if now >= next_report:
+                    with self.lock:
+                        print(f"[~] sent {frames} frames ({sent_bytes / 1e6:.2f} MB) in the last second, "
+                              f"acks={self.acks} acked_files={self.acked_files} feedback={self.last_feedback}")
+                    frames = sent_bytes = 0
+                    next_report += 1.0
+                if now < next_frame:
+                    time.sleep(min(next_frame, next_report) - now)
+                    continue
+
+                frame_time = datetime.now()
+                name = f"{event}_{frame_time.strftime('%Y%m%d_%H%M%S')}_{frame_time.microsecond // 10000:02d}_frame{frames:06d}"
+                payload = (build_packets(name + '.bin', DATA_TYPE_BIN, self.depth_data)
+                           + build_packets(name + '.jpg', DATA_TYPE_JPEG, self.jpeg_at_quality()))
+                sock.sendall(payload)
+                frames += 1
+                sent_bytes += len(payload)
+                with self.lock:
+                    next_frame = max(next_frame + 1.0 / self.frame_rate, now - 1.0)
+        finally:
+            sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream example frames to the iLiDAR server over loopback.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5678)
+    parser.add_argument('--fps', type=float, default=30.0, help="initial frame rate")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to stream")
+    parser.add_argument('--no-adapt', action='store_true', help="ignore the suggested frame rate and quality")
+    parser.add_argument('--depth', default='./example_data/example_depth_data.bin')
+    parser.add_argument('--color', default='./example_data/example_rgb_image.jpg')
+    args = parser.parse_args()
+
+    simulator = PhoneSimulator(args.host, args.port, args.fps, not args.no_adapt, args.depth, args.color)
+    simulator.run(args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+# =========================
+# iLiDAR
+# profiling.py
+# =========================
+
+import collections
+import cProfile
+import json
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+
+# =========================
+# Configuration Parameters
+# =========================
+
+PROFILING_ENABLED = False        # Capture spans from start-up; SIGUSR1 toggles at runtime
+TRACE_BUFFER_SIZE = 100000       # Spans kept in the ring buffer
+CPROFILE_WINDOW = 10.0           # Seconds profiled by cProfile after SIGUSR2
+PROFILE_DIRECTORY = 'profiles'   # Where traces and cProfile stats are written
+
+# From Python 3.12 cProfile hooks sys.monitoring, which sees every thread but
+# allows a single enabled profiler per process
+PROCESS_WIDE_CPROFILE = sys.version_info >= (3, 12)
+
+# =========================
+# Helper Classes and Methods
+# =========================
+
+class _NullSpan:
+    """
+    Shared no-op context manager returned while profiling is off.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.cprofile_active:
+            try:
+                self.profiler.attach_cprofile()
+            except Exception as e:
+                # Profiling must never break the instrumented code
+                self.profiler.attach_failed(e)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        if self.profiler.capturing:
+            # deque.append is atomic, so spans from all threads share one buffer without a lock
+            self.profiler.spans.append((self.name, self.start, end - self.start, threading.get_ident()))
+        return False
+
+
+class Profiler:
+    """
+    Records named spans of the server hot path into a ring buffer and dumps
+    them as a Chrome trace (chrome://tracing, Perfetto).
+
+    Instrumented code uses `with PROFILER.span('stage'):`. While profiling is
+    off, span() only tests one attribute and returns a shared no-op object,
+    see benchmark() for the overhead.
+
+    A cProfile window can also be started. From Python 3.12 a single profile,
+    enabled by a helper thread, covers the whole process. Before 3.12 cProfile
+    only sees the thread that enables it, so each thread attaches its own
+    profile on its first span in the window and detaches it on its first span
+    afterwards; the per-thread stats are merged into one file when the window
+    ends.
+    """
+    def __init__(self, buffer_size=TRACE_BUFFER_SIZE, directory=PROFILE_DIRECTORY):
+        self.spans = collections.deque(maxlen=buffer_size)  # (name, start_ns, duration_ns, thread id)
+        self.directory = directory
+        self.capturing = False
+        self.cprofile_active = False
+        self.cprofile_until = 0.0
+        self.cprofiles = {}     # Maps thread id to the cProfile.Profile attached in that thread
+        self.finished = []      # Profiles detached by their own thread, ready to merge
+        self.cprofile_dumped = True  # False while a cProfile window is running or waiting to be written
+        self.cprofile_failed = set()  # Threads that could not attach a profile in the current window
+        self.lock = threading.Lock()
+        self.active = False     # capturing or cprofile_active, the only test on the fast path
+
+    def span(self, name):
+        if not self.active:
+            return NULL_SPAN
+        return _Span(self, name)
+
+    def update_active(self):
+        self.active = self.capturing or self.cprofile_active
+
+    def start(self):
+        self.capturing = True
+        self.update_active()
+        print("[*] Profiling: span capture started.")
+
+    def stop(self):
+        self.capturing = False
+        self.update_active()
+        print("[*] Profiling: span capture stopped.")
+
+    def toggle(self):
+        """
+        Starts span capture, or stops it and writes the trace.
+        """
+        if self.capturing:
+            self.stop()
+            self.dump_trace()
+        else:
+            self.start()
+
+    def dump_trace(self, path=None):
+        """
+        Writes the buffered spans as Chrome trace-event JSON and returns the path.
+        """
+        if path is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, time.strftime('trace_%Y%m%d_%H%M%S.json'))
+        spans = list(self.spans)
+        pid = os.getpid()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                   'args': {'name': thread_names.get(tid, str(tid))}}
+                  for tid in {span[3] for span in spans}]
+        events += [{'name': name, 'ph': 'X', 'pid': pid, 'tid': tid, 'ts': start / 1000.0, 'dur': duration / 1000.0}
+                   for name, start, duration, tid in spans]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        print(f"[+] Profiling: wrote {len(spans)} spans to {path}")
+        return path
+
+    def start_cprofile(self, window=CPROFILE_WINDOW):
+        """
+        Profiles the server threads for `window` seconds.
+        """
+        with self.lock:
+            if self.cprofile_active or not self.cprofile_dumped:
+                return
+            self.cprofile_dumped = False
+            if not PROCESS_WIDE_CPROFILE:
+                self.cprofile_until = time.perf_counter() + window
+                self.cprofile_failed.clear()
+                self.cprofile_active = True
+                self.update_active()
+        if PROCESS_WIDE_CPROFILE:
+            threading.Thread(target=self.run_cprofile, args=(window,), daemon=True).start()
+            return
+        print(f"[*] Profiling: cProfile attached for {window:.0f} s.")
+        # Collect once the window is over; one extra second lets busy threads detach
+        timer = threading.Timer(window + 1.0, self.dump_cprofile)
+        timer.daemon = True
+        timer.start()
+
+    def run_cprofile(self, window):
+        """
+        Runs one process-wide cProfile window (Python 3.12+), in its own thread.
+        """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Another profiler (a debugger, an IDE) already owns sys.monitoring
+            print(f"[!] Profiling: cannot start cProfile: {e}")
+            with self.lock:
+                self.cprofile_dumped = True
+            return
+        print(f"[*] Profiling: cProfile attached for {window:.0f} s.")
+        time.sleep(window)
+        profile.disable()
+        with self.lock:
+            self.cprofile_dumped = True
+        self.write_cprofile([profile], "all threads")
+
+    def attach_cprofile(self):
+        """
+        Called on span entry while cProfile is active, in the thread being profiled.
+        """
+        tid = threading.get_ident()
+        expired = time.perf_counter() >= self.cprofile_until
+        with self.lock:
+            profile = self.cprofiles.get(tid)
+            if profile is None and not expired and tid not in self.cprofile_failed:
+                profile = cProfile.Profile()
+                profile.enable()
+                self.cprofiles[tid] = profile
+            elif profile is not None and expired:
+                profile.disable()
+                del self.cprofiles[tid]
+                if not self.cprofile_dumped:
+                    self.finished.append(profile)
+                self.update_cprofile_active()
+
+    def attach_failed(self, error):
+        """
+        Skips cProfile for the calling thread for the rest of the window, logging once.
+        """
+        tid = threading.get_ident()
+        with self.lock:
+            if tid in self.cprofile_failed:
+                return
+            self.cprofile_failed.add(tid)
+        print(f"[!] Profiling: cannot attach cProfile in thread {threading.current_thread().name}: {error}")
+
+    def update_cprofile_active(self):
+        # Stay on the span path until every thread has detached its profile
+        self.cprofile_active = not self.cprofile_dumped or bool(self.cprofiles)
+        self.update_active()
+
+    def dump_cprofile(self):
+        with self.lock:
+            self.cprofile_dumped = True
+            profiles, self.finished = self.finished, []
+            # Threads that went idle before the window ended still have their
+            # profile attached: take a snapshot now, they detach on their next span.
+            # Exited threads never will, so forget them after the snapshot.
+            lingering = list(self.cprofiles.values())
+            alive = {thread.ident for thread in threading.enumerate()}
+            for tid in list(self.cprofiles):
+                if tid not in alive:
+                    del self.cprofiles[tid]
+            self.update_cprofile_active()
+        if not profiles and not lingering:
+            print("[!] Profiling: no instrumented thread ran during the cProfile window.")
+            return None
+        return self.write_cprofile(profiles + lingering, f"{len(profiles) + len(lingering)} threads")
+
+    def write_cprofile(self, profiles, description):
+        """
+        Merges the profiles into one stats file and returns its path.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, time.strftime('cprofile_%Y%m%d_%H%M%S.prof'))
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(path)
+        print(f"[+] Profiling: wrote cProfile stats of {description} to {path} (python -m pstats {path})")
+        return path
+
+
+PROFILER = Profiler()
+
+
+def install_signal_handlers(profiler=PROFILER):
+    """
+    SIGUSR1 toggles span capture (dumping the trace when it stops), SIGUSR2
+    starts a cProfile window.
+
+    Python signal handlers only run on the main thread, which is blocked in
+    rclpy.spin, so the signals are instead blocked and received by a
+    dedicated thread with sigwait. Must be called from the main thread
+    before any other thread is started, so that they all inherit the mask.
+    """
+    if PROFILING_ENABLED:
+        profiler.start()
+    if not hasattr(signal, 'pthread_sigmask'):
+        return  # Not available on Windows
+    signals = {signal.SIGUSR1, signal.SIGUSR2}
+    signal.pthread_sigmask(signal.SIG_BLOCK, signals)
+    threading.Thread(target=wait_for_signals, args=(profiler, signals), name='profiling-signals', daemon=True).start()
+    print(f"[*] Profiling: kill -USR1 {os.getpid()} toggles span capture, kill -USR2 {os.getpid()} runs cProfile.")
+
+
+def wait_for_signals(profiler, signals):
+    while True:
+        signum = signal.sigwait(signals)
+        try:
+            if signum == signal.SIGUSR1:
+                profiler.toggle()
+            else:
+                profiler.start_cprofile()
+        except Exception as e:
+            print(f"[!] Profiling: failed to handle signal {signum}: {e}")
+
+
+def benchmark(iterations=1000000):
+    """
+    Measures the cost of an instrumented call site with profiling off and on.
+    """
+    profiler = Profiler(buffer_size=1024)
+
+    def bare():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            pass
+        return time.perf_counter() - start
+
+    def instrumented():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with profiler.span('stage'):
+                pass
+        return time.perf_counter() - start
+
+    baseline = min(bare() for _ in range(3))
+    disabled = min(instrumented() for _ in range(3))
+    profiler.start()
+    enabled = min(instrumented() for _ in range(3))
+    profiler.stop()
+
+    for label, elapsed in (('disabled', disabled), ('enabled', enabled)):
+        print(f"{label:>9}: {(elapsed - baseline) / iterations * 1e9:7.1f} ns per span")
+    return (disabled - baseline) / iterations, (enabled - baseline) / iterations
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -43,6 +43,26 @@ def read_raw_depth_data(file_path, width, height):
 
     return depth_data
 
+def depth_to_points(depth_data, fx, fy, cx, cy):
+    """
+    Unprojects a depth map into a point cloud in the camera frame.
+
+    Parameters:
+    - depth_data: numpy.ndarray, the 2D array of depth values in meters
+    - fx, fy: float, focal lengths of the camera
+    - cx, cy: float, principal point offsets of the camera
+
+    Returns:
+    - points: numpy.ndarray, (N, 3) float32 array of x, y, z; invalid (zero or NaN) depths are skipped
+    """
+    z = depth_data.astype(np.float32)
+    valid = np.isfinite(z) & (z > 0)
+    v, u = np.nonzero(valid)
+    z = z[valid]
+    x = (u - np.float32(cx)) * z / np.float32(fx)
+    y = (v - np.float32(cy)) * z / np.float32(fy)
+    return np.stack((x, y, z), axis=1).astype(np.float32, copy=False)
+
 def visualize_depth_data(depth_data):
     """
     Visualizes the depth data as a heatmap.
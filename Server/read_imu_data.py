@@ -0,0 +1,117 @@
+# =========================
+# iLiDAR
+# read_imu_data.py
+# =========================
+
+import time
+import numpy as np
+
+# =========================
+# Configuration Parameters
+# =========================
+
+# Column layout of an IMU sample, shared by the CSV and binary payloads:
+# timestamp (s since epoch), orientation quaternion (x, y, z, w),
+# rotation rate (rad/s), acceleration (g, gravity + user acceleration, CoreMotion
+# sign convention: a phone lying face up reads z = -1)
+IMU_COLUMNS = ('timestamp',
+               'quat_x', 'quat_y', 'quat_z', 'quat_w',
+               'rot_x', 'rot_y', 'rot_z',
+               'acc_x', 'acc_y', 'acc_z')
+IMU_NUM_COLUMNS = len(IMU_COLUMNS)
+
+# Binary batch: consecutive samples, each IMU_NUM_COLUMNS little-endian float64
+IMU_SAMPLE_DTYPE = np.dtype('<f8')
+IMU_SAMPLE_SIZE = IMU_NUM_COLUMNS * IMU_SAMPLE_DTYPE.itemsize  # 88 bytes
+
+STANDARD_GRAVITY = 9.80665  # m/s^2 per g
+
+# =========================
+# Helper Classes and Methods
+# =========================
+
+def parse_imu_csv(data):
+    """
+    Parses a batch of IMU samples sent as CSV, one sample per line.
+
+    The whole payload is tokenized at once and converted by numpy, instead of
+    splitting and converting each line separately.
+
+    Parameters:
+    - data: bytes, UTF-8 CSV lines with IMU_NUM_COLUMNS values each
+
+    Returns:
+    - samples: numpy.ndarray, (N, IMU_NUM_COLUMNS) float64 array
+    """
+    tokens = data.replace(b'\r', b'').strip().replace(b'\n', b',').split(b',')
+    if tokens == [b'']:
+        return np.empty((0, IMU_NUM_COLUMNS), dtype=np.float64)
+    if len(tokens) % IMU_NUM_COLUMNS != 0:
+        raise ValueError(f"IMU CSV has {len(tokens)} values, expected a multiple of {IMU_NUM_COLUMNS}.")
+    return np.array(tokens, dtype=np.float64).reshape((-1, IMU_NUM_COLUMNS))
+
+
+def parse_imu_binary(data):
+    """
+    Parses a batch of IMU samples sent as packed little-endian float64 records.
+
+    Parameters:
+    - data: bytes, a multiple of IMU_SAMPLE_SIZE bytes
+
+    Returns:
+    - samples: numpy.ndarray, (N, IMU_NUM_COLUMNS) float64 array (read-only view of data)
+    """
+    if len(data) % IMU_SAMPLE_SIZE != 0:
+        raise ValueError(f"IMU batch size {len(data)} is not a multiple of {IMU_SAMPLE_SIZE} bytes.")
+    return np.frombuffer(data, dtype=IMU_SAMPLE_DTYPE).reshape((-1, IMU_NUM_COLUMNS))
+
+
+def parse_imu_csv_lines(data):
+    """
+    Reference line-by-line parser, only used as the benchmark baseline.
+    """
+    rows = [[float(v) for v in line.split(',')] for line in data.decode('utf-8').splitlines() if line]
+    return np.array(rows, dtype=np.float64).reshape((-1, IMU_NUM_COLUMNS))
+
+
+def make_imu_batch(num_samples, rate=400.0, start_time=None):
+    """
+    Generates a synthetic batch of IMU samples for benchmarks and simulation.
+
+    Returns:
+    - samples: numpy.ndarray, (num_samples, IMU_NUM_COLUMNS) float64 array
+    """
+    if start_time is None:
+        start_time = time.time()
+    rng = np.random.default_rng(0)
+    samples = rng.normal(size=(num_samples, IMU_NUM_COLUMNS))
+    samples[:, 0] = start_time + np.arange(num_samples) / rate
+    quat = samples[:, 1:5]
+    quat /= np.linalg.norm(quat, axis=1, keepdims=True)
+    return samples
+
+
+def benchmark(num_samples=400, repeats=200):
+    """
+    Measures parser throughput in samples per second for one batch size.
+    """
+    samples = make_imu_batch(num_samples)
+    csv_data = ''.join('%.3f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f\n' % tuple(row)
+                       for row in samples).encode('utf-8')
+    bin_data = samples.astype(IMU_SAMPLE_DTYPE).tobytes()
+
+    for name, parser, data in (('csv (line-by-line)', parse_imu_csv_lines, csv_data),
+                               ('csv (vectorized)', parse_imu_csv, csv_data),
+                               ('binary', parse_imu_binary, bin_data)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            parser(data)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>20}: {num_samples * repeats / elapsed:14,.0f} samples/s "
+              f"({elapsed / repeats * 1e6:8.1f} us per {num_samples}-sample batch)")
+
+
+if __name__ == "__main__":
+    for batch in (20, 100, 400):
+        print(f"Batch of {batch} samples:")
+        benchmark(num_samples=batch, repeats=max(100, 40000 // batch))
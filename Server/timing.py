@@ -0,0 +1,240 @@
+# =========================
+# iLiDAR
+# timing.py
+# =========================
+
+import collections
+import re
+import time
+from datetime import datetime
+
+# =========================
+# Configuration Parameters
+# =========================
+
+# Number of recent frames used to estimate the phone-to-host clock offset
+OFFSET_WINDOW = 300
+
+# A sample this far (seconds) from the current estimate means the phone clock
+# was stepped (NTP sync, timezone or DST change); the window is restarted
+OFFSET_RESET_THRESHOLD = 1.0
+
+# A step that increases the offset only resets the window after this many
+# consecutive samples above the threshold, so a short network stall does not
+OFFSET_STEP_SAMPLES = 30
+
+# Number of latency samples kept per stream for the percentile report
+LATENCY_WINDOW = 1000
+
+# Seconds between two latency reports of a connection
+LATENCY_REPORT_INTERVAL = 5.0
+
+# Frame names are [event yyyyMMdd_HHmmss]_[frame yyyyMMdd_HHmmss_SS]_frame%06d,
+# see DataStorage.frameName on the iOS side. SS is hundredths of a second.
+FRAME_TIMESTAMP_PATTERN = re.compile(r'^\d{8}_\d{6}_(\d{8})_(\d{6})_(\d{2})_frame\d+')
+
+# =========================
+# Helper Classes and Methods
+# =========================
+
+def parse_frame_timestamp(filename):
+    """
+    Extracts the capture time embedded in a frame filename.
+
+    The phone formats the timestamp in its local time zone; it is interpreted
+    in the host's local time zone here; any difference is absorbed by the
+    clock offset estimate.
+
+    Parameters:
+    - filename: str, e.g. '20241208_223229_20241208_223232_76_frame000316.jpg'
+
+    Returns:
+    - capture_time: float, seconds since the epoch, or None if the filename
+      carries no frame timestamp (calibration CSV, IMU data)
+    """
+    match = FRAME_TIMESTAMP_PATTERN.match(filename)
+    if match is None:
+        return None
+    date_part, time_part, hundredths = match.groups()
+    try:
+        capture = datetime.strptime(date_part + time_part, '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+    return capture.timestamp() + int(hundredths) / 100.0
+
+
+class ClockOffsetEstimator:
+    """
+    Online estimate of the offset between the phone clock and the host clock.
+
+    Every received frame gives a sample (host arrival time - device capture
+    time) = true offset + transmission delay. Since the delay is never
+    negative, the minimum over a sliding window is a robust estimate that is
+    insensitive to queueing spikes. It absorbs the fastest delay seen in the
+    window, so corrected latencies are relative to the best-case link.
+
+    A clock step that lowers the samples shows up at once as a new minimum. A
+    step that raises them (the phone clock going back, e.g. at the end of
+    DST) looks like a delay spike, so it is only taken as a step once it
+    persists for step_samples samples.
+    """
+    def __init__(self, window=OFFSET_WINDOW, reset_threshold=OFFSET_RESET_THRESHOLD, step_samples=OFFSET_STEP_SAMPLES):
+        self.window = window
+        self.reset_threshold = reset_threshold
+        self.step_samples = step_samples
+        self.samples = collections.deque()  # (index, sample), increasing samples
+        self.count = 0
+        self.above = 0  # Consecutive samples above the estimate by more than reset_threshold
+
+    def add_sample(self, device_time, host_time):
+        """
+        Adds one (device capture time, host arrival time) pair and returns the updated offset.
+        """
+        sample = host_time - device_time
+        if self.samples:
+            jump = sample - self.samples[0][1]
+            self.above = self.above + 1 if jump > self.reset_threshold else 0
+            if jump < -self.reset_threshold or self.above >= self.step_samples:
+                print(f"[!] Phone clock jumped by {-jump:.3f} s, resetting offset estimate.")
+                self.samples.clear()
+                self.above = 0
+
+        # Monotonic deque: the front always holds the window minimum
+        while self.samples and self.samples[-1][1] >= sample:
+            self.samples.pop()
+        self.samples.append((self.count, sample))
+        self.count += 1
+        while self.samples[0][0] <= self.count - 1 - self.window:
+            self.samples.popleft()
+        return self.samples[0][1]
+
+    @property
+    def offset(self):
+        """
+        Current offset in seconds (host = device + offset), or None before the first sample.
+        """
+        if not self.samples:
+            return None
+        return self.samples[0][1]
+
+    def to_host_time(self, device_time):
+        """
+        Converts a device timestamp to host time using the current offset estimate.
+        """
+        offset = self.offset
+        if offset is None:
+            return None
+        return device_time + offset
+
+
+class LatencyTracker:
+    """
+    Keeps the recent capture-to-publish latencies of one stream. The label
+    allows reporting other durations, such as processing times, the same way.
+    """
+    def __init__(self, stream_name, window=LATENCY_WINDOW, label='Latency'):
+        self.stream_name = stream_name
+        self.label = label
+        self.latencies = collections.deque(maxlen=window)
+
+    def add(self, latency):
+        self.latencies.append(latency)
+
+    def percentiles(self, quantiles=(0.5, 0.9, 0.99)):
+        """
+        Returns the requested latency quantiles in seconds, or None if no samples were recorded.
+        """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return [ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in quantiles]
+
+    def report(self):
+        values = self.percentiles()
+        if values is None:
+            return
+        p50, p90, p99 = (v * 1000.0 for v in values)
+        print(f"[~] {self.label} {self.stream_name}: n={len(self.latencies)} "
+              f"p50={p50:.1f} ms p90={p90:.1f} ms p99={p99:.1f} ms max={max(self.latencies) * 1000.0:.1f} ms")
+
+
+class StreamClock:
+    """
+    Stamps the frames of one connection with their corrected capture time and
+    records capture-to-publish latency per stream.
+    """
+    def __init__(self, report_interval=LATENCY_REPORT_INTERVAL):
+        self.offset_estimator = ClockOffsetEstimator()
+        # IMU samples carry epoch timestamps rather than the local time of the
+        # frame names, so they are a separate clock domain
+        self.imu_offset_estimator = ClockOffsetEstimator()
+        self.trackers = {}  # Maps stream name to LatencyTracker
+        self.report_interval = report_interval
+        self.last_report = time.time()
+
+    def capture_time(self, filename, arrival_time):
+        """
+        Returns the capture time of a frame in host time, or None if the
+        filename has no embedded timestamp.
+
+        Parameters:
+        - filename: str, name of the received file
+        - arrival_time: float, host time (time.time()) at which the file was completed
+        """
+        device_time = parse_frame_timestamp(filename)
+        if device_time is None:
+            return None
+        self.offset_estimator.add_sample(device_time, arrival_time)
+        return self.offset_estimator.to_host_time(device_time)
+
+    def imu_times(self, device_times, arrival_time):
+        """
+        Converts the timestamps of an IMU batch to host time.
+
+        Parameters:
+        - device_times: numpy.ndarray, sample timestamps in phone epoch seconds
+        - arrival_time: float, host time at which the batch was completed
+
+        Returns:
+        - host_times: numpy.ndarray, corrected sample timestamps
+        """
+        # The newest sample is the one closest to the arrival time
+        offset = self.imu_offset_estimator.add_sample(float(device_times[-1]), arrival_time)
+        return device_times + offset
+
+    def record_publish(self, stream_name, capture_time, publish_time=None):
+        """
+        Records the latency of a message that has just been published.
+        """
+        if capture_time is None:
+            return
+        if publish_time is None:
+            publish_time = time.time()
+        tracker = self.trackers.get(stream_name)
+        if tracker is None:
+            tracker = self.trackers[stream_name] = LatencyTracker(stream_name)
+        tracker.add(publish_time - capture_time)
+
+        if publish_time - self.last_report >= self.report_interval:
+            self.last_report = publish_time
+            self.report()
+
+    def report(self):
+        """
+        Prints the current clock offset and the latency distribution of every stream.
+        """
+        offset = self.offset_estimator.offset
+        if offset is not None:
+            print(f"[~] Phone-to-host clock offset: {offset:+.3f} s")
+        for tracker in list(self.trackers.values()):
+            tracker.report()
+
+
+def to_stamp(seconds):
+    """
+    Converts host time in seconds to a builtin_interfaces/Time message.
+    """
+    # Imported here so the timing helpers stay usable without a ROS install
+    from builtin_interfaces.msg import Time
+    sec = int(seconds)
+    return Time(sec=sec, nanosec=int((seconds - sec) * 1e9))
@@ -0,0 +1,213 @@
+# =========================
+# iLiDAR
+# voxel_map.py
+# =========================
+
+import time
+import numpy as np
+
+# =========================
+# Configuration Parameters
+# =========================
+
+VOXEL_SIZE = 0.05        # Edge length of a voxel and of a height map cell (m)
+WINDOW_RADIUS = 5.0      # Voxels farther than this from the sensor along any axis are evicted (m)
+OCCUPIED_HITS = 3        # Frames that must hit a voxel before it counts as occupied
+MAX_AGE_FRAMES = 30      # Voxels not hit in this many frames are evicted (about 1 s at 30 fps)
+
+# Voxel indices are packed into one int64 key, 21 bits per axis
+KEY_BITS = 21
+KEY_OFFSET = 1 << (KEY_BITS - 1)
+KEY_MASK = (1 << KEY_BITS) - 1
+
+# Occupancy values reported for changed cells
+CELL_OCCUPIED = 1.0
+CELL_UNKNOWN = -1.0  # Cell aged out, left the window or no longer holds an occupied voxel
+
+# =========================
+# Helper Classes and Methods
+# =========================
+
+def pack_keys(indices):
+    """
+    Packs (N, 3) integer voxel indices into int64 keys.
+    """
+    shifted = indices.astype(np.int64) + KEY_OFFSET
+    return (shifted[:, 0] << (2 * KEY_BITS)) | (shifted[:, 1] << KEY_BITS) | shifted[:, 2]
+
+
+def unpack_keys(keys):
+    """
+    Inverse of pack_keys, returns (N, 3) int64 voxel indices.
+    """
+    return np.stack(((keys >> (2 * KEY_BITS)) & KEY_MASK,
+                     (keys >> KEY_BITS) & KEY_MASK,
+                     keys & KEY_MASK), axis=1) - KEY_OFFSET
+
+
+def unique_keys(keys):
+    """
+    Returns the distinct keys in ascending order.
+
+    Sorts explicitly: recent numpy versions serve np.unique without
+    return_counts from a hash table, which is much slower for int64 keys.
+    """
+    keys = np.sort(keys)
+    if len(keys) == 0:
+        return keys
+    return keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+
+
+def lookup(sorted_keys, query):
+    """
+    Finds query keys in a sorted key array.
+
+    Returns:
+    - position: numpy.ndarray, index of each query in sorted_keys (insertion point if absent)
+    - found: numpy.ndarray, bool mask of the queries present in sorted_keys
+    """
+    position = np.searchsorted(sorted_keys, query)
+    found = np.zeros(len(query), dtype=bool)
+    in_range = position < len(sorted_keys)
+    found[in_range] = sorted_keys[position[in_range]] == query[in_range]
+    return position, found
+
+
+class VoxelMap:
+    """
+    Sparse voxel hash fused from depth frames, with a 2.5D height map on top.
+
+    Points are in the camera frame (x right, y down, z forward), so the ground
+    plane is spanned by x and z and height is -y; this assumes the phone is
+    held roughly level. Only ray endpoints are integrated, and free space
+    along the ray is not carved. A frame adds at most one hit to a voxel
+    however many of its points fall in it, so occupied_hits filters out
+    voxels seen in a single noisy frame.
+
+    The camera frame moves with the phone, so without a pose the map must
+    only reflect what is currently in view: voxels that were not hit in the
+    last max_age_frames frames are evicted. With a pose source, points can be
+    given in a fixed frame together with sensor_origin, and voxels outside a
+    cube of WINDOW_RADIUS around the sensor are evicted as well.
+
+    The hash is a set of sorted numpy arrays (keys, hits, last hit frame) so
+    that a whole frame is merged with np.unique and np.searchsorted instead
+    of a Python loop.
+    """
+    def __init__(self, voxel_size=VOXEL_SIZE, window_radius=WINDOW_RADIUS, occupied_hits=OCCUPIED_HITS,
+                 max_age_frames=MAX_AGE_FRAMES):
+        self.voxel_size = voxel_size
+        self.window_cells = int(np.ceil(window_radius / voxel_size))
+        self.occupied_hits = occupied_hits
+        self.max_age_frames = max_age_frames
+        self.frame = 0
+        self.keys = np.empty(0, dtype=np.int64)      # Sorted voxel keys
+        self.hits = np.empty(0, dtype=np.int32)      # Frames that hit each voxel
+        self.last_hit = np.empty(0, dtype=np.int64)  # Frame number of the latest hit per voxel
+        self.changed_columns = np.empty((0, 2), dtype=np.int64)  # (ix, iz) touched since last changes()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def integrate(self, points, sensor_origin=(0.0, 0.0, 0.0)):
+        """
+        Fuses one frame of points into the map.
+
+        Parameters:
+        - points: numpy.ndarray, (N, 3) points in the map frame
+        - sensor_origin: sequence of 3 floats, sensor position in the map frame
+
+        Returns:
+        - elapsed: float, update time in seconds
+        """
+        start = time.perf_counter()
+        self.frame += 1
+        origin = np.floor(np.asarray(sensor_origin, dtype=np.float64) / self.voxel_size).astype(np.int64)
+
+        indices = np.floor(points / self.voxel_size).astype(np.int64)
+        in_window = np.all(np.abs(indices - origin) <= self.window_cells, axis=1)
+        frame_keys = unique_keys(pack_keys(indices[in_window]))
+
+        # Voxels already in the hash: add one hit in place
+        position, existing = lookup(self.keys, frame_keys)
+        before = self.hits[position[existing]] >= self.occupied_hits
+        self.hits[position[existing]] += 1
+        after = self.hits[position[existing]] >= self.occupied_hits
+        self.last_hit[position[existing]] = self.frame
+        changed = [frame_keys[existing][before != after]]
+
+        # New voxels: insert keeping the arrays sorted
+        new_keys = frame_keys[~existing]
+        if len(new_keys):
+            insert_at = position[~existing]
+            self.keys = np.insert(self.keys, insert_at, new_keys)
+            self.hits = np.insert(self.hits, insert_at, 1)
+            self.last_hit = np.insert(self.last_hit, insert_at, self.frame)
+            if self.occupied_hits <= 1:
+                changed.append(new_keys)
+
+        # Drop voxels that were not seen recently or are now out of range
+        keep = self.frame - self.last_hit < self.max_age_frames
+        keep &= np.all(np.abs(unpack_keys(self.keys) - origin) <= self.window_cells, axis=1)
+        if not keep.all():
+            changed.append(self.keys[~keep & (self.hits >= self.occupied_hits)])
+            self.keys = self.keys[keep]
+            self.hits = self.hits[keep]
+            self.last_hit = self.last_hit[keep]
+
+        changed_keys = np.concatenate(changed)
+        if len(changed_keys):
+            self.changed_columns = np.concatenate((self.changed_columns, unpack_keys(changed_keys)[:, [0, 2]]))
+        return time.perf_counter() - start
+
+    def changes(self):
+        """
+        Returns the height map cells whose value changed since the previous call.
+
+        Returns:
+        - cells: numpy.ndarray, (M, 4) float32 array of x, top y, z and occupancy per
+          cell; x and z are the cell center, top y is the upper face of the highest
+          occupied voxel in the column (y points down), occupancy is CELL_OCCUPIED or
+          CELL_UNKNOWN (top y is NaN then)
+        """
+        columns = np.unique(self.changed_columns, axis=0)
+        self.changed_columns = np.empty((0, 2), dtype=np.int64)
+        cells = np.empty((len(columns), 4), dtype=np.float32)
+        if len(columns) == 0:
+            return cells
+
+        occupied = unpack_keys(self.keys[self.hits >= self.occupied_hits])
+        # Highest voxel per column is the smallest y index
+        column_keys = pack_keys(np.stack((occupied[:, 0], np.zeros(len(occupied), dtype=np.int64), occupied[:, 2]), axis=1))
+        order = np.lexsort((occupied[:, 1], column_keys))
+        unique_columns, first = np.unique(column_keys[order], return_index=True)
+        top_y = occupied[order][first, 1]
+
+        query = pack_keys(np.stack((columns[:, 0], np.zeros(len(columns), dtype=np.int64), columns[:, 1]), axis=1))
+        position, found = lookup(unique_columns, query)
+
+        cells[:, 0] = (columns[:, 0] + 0.5) * self.voxel_size
+        cells[:, 2] = (columns[:, 1] + 0.5) * self.voxel_size
+        cells[:, 1] = np.nan
+        cells[found, 1] = top_y[position[found]] * self.voxel_size
+        cells[:, 3] = np.where(found, CELL_OCCUPIED, CELL_UNKNOWN)
+        return cells
+
+
+if __name__ == "__main__":
+    from read_depth_data import read_raw_depth_data, depth_to_points
+
+    depth_data = read_raw_depth_data("./example_data/example_depth_data.bin", 320, 240)
+    points = depth_to_points(depth_data, 498.72195, 498.72195, 317.22327, 239.91258)
+    voxel_map = VoxelMap()
+    rng = np.random.default_rng(0)
+    timings = []
+    for frame in range(100):
+        # Jitter the frame a little so that hits accumulate like a live stream
+        noisy = points + rng.normal(scale=0.01, size=points.shape).astype(np.float32)
+        timings.append(voxel_map.integrate(noisy))
+        if frame % 10 == 9:
+            cells = voxel_map.changes()
+            print(f"frame {frame + 1}: {len(voxel_map)} voxels, {len(cells)} changed cells")
+    timings = np.array(timings) * 1000.0
+    print(f"Update time per {len(points)}-point frame: median {np.median(timings):.2f} ms, max {timings.max():.2f} ms")
@@ -11,6 +11,13 @@ class IMUManager: ObservableObject {
     @Published var angularVelocity = CMRotationRate(x: 0, y: 0, z: 0)
     @Published var linearAcceleration = CMAcceleration(x: 0, y: 0, z: 0)
 
+    // Samples are accumulated and sent as one binary batch to keep the per-packet
+    // overhead low at high rates
+    private let batchInterval: TimeInterval = 0.05
+    private var batch = Data()
+    private var batchStart: TimeInterval = 0
+    private var batchCounter = 0
+
     // MARK: - Device Motion Updates
     private func startDeviceMotionUpdates() {
         guard motionManager.isDeviceMotionAvailable else { return }
@@ -36,36 +43,8 @@ class IMUManager: ObservableObject {
         startDeviceMotionUpdates()
     }
 
-    func startDummyStreaming(frequency: Double) {
-        guard !isStreaming else {return}
-        self.frequency = frequency
-        isStreaming = true
-
-        let quat_x = 0.1
-        let quat_y = 0.2
-        let quat_z = 0.3
-        let quat_w = 0.4
-
-        let rot_x = 1.1
-        let rot_y = 1.2
-        let rot_z = 1.3
-
-        let acc_x = 2.1
-        let acc_y = 2.2
-        let acc_z = 2.3
-
-
-        let timestamp = Date().timeIntervalSince1970
-        let csv = String(format: "%.3f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f\n", timestamp, quat_x, quat_y, quat_z, quat_w, rot_x, rot_y, rot_z, acc_x, acc_y, acc_z)
-        let fileName = "imu_" + DataStorage.shared.eventName()
-        if let data = csv.data(using: .utf8) {
-            DataStorage.shared.socketManager.sendCSV(fileName: fileName, data: data)
-        }
-
-        print("Sending dummy values now!")
-    }
-
     func stopStreaming() {
+        flushBatch()
         isStreaming = false
         if !isPreviewing { stopDeviceMotionUpdates() }
     }
@@ -87,12 +66,33 @@ class IMUManager: ObservableObject {
     private func sendIMUData(_ data: CMDeviceMotion) {
         let quat = data.attitude.quaternion
         let rot = data.rotationRate
-        let acc = data.userAcceleration
-        let timestamp = Date().timeIntervalSince1970
-        let csv = String(format: "%.3f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f\n", timestamp, quat.x, quat.y, quat.z, quat.w, rot.x, rot.y, rot.z, acc.x, acc.y, acc.z)
-        let fileName = "imu_" + DataStorage.shared.eventName()
-        if let data = csv.data(using: .utf8) {
-            DataStorage.shared.socketManager.sendCSV(fileName: fileName, data: data)
+        // Send the total acceleration like the raw accelerometer (gravity included);
+        // the server converts it to the ROS sign convention
+        let acc = CMAcceleration(x: data.gravity.x + data.userAcceleration.x,
+                                 y: data.gravity.y + data.userAcceleration.y,
+                                 z: data.gravity.z + data.userAcceleration.z)
+        // data.timestamp is seconds since boot; convert it to the epoch so each
+        // sample keeps its own capture time
+        let now = Date().timeIntervalSince1970
+        let timestamp = now - (ProcessInfo.processInfo.systemUptime - data.timestamp)
+        let values: [Double] = [timestamp, quat.x, quat.y, quat.z, quat.w, rot.x, rot.y, rot.z, acc.x, acc.y, acc.z]
+        if batch.isEmpty {
+            batchStart = now
         }
+        for value in values {
+            var littleEndian = value.bitPattern.littleEndian
+            batch.append(Data(bytes: &littleEndian, count: 8))
+        }
+        if now - batchStart >= batchInterval {
+            flushBatch()
+        }
+    }
+
+    private func flushBatch() {
+        guard !batch.isEmpty else { return }
+        let fileName = "imu_" + DataStorage.shared.eventName() + String(format: "_%06d", batchCounter)
+        DataStorage.shared.socketManager.sendIMU(fileName: fileName, data: batch)
+        batchCounter += 1
+        batch = Data()
     }
-} 
+}
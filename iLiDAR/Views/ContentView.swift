@@ -87,8 +87,7 @@ struct ContentView: View {
                         manager.controller.startStream()
                     }
                     if imuEnabled {
-                        imuManager.startDummyStreaming(frequency: imuFrequency)
-                        print("start dummy stream from button side")
+                        imuManager.startStreaming(frequency: imuFrequency)
                     }
                 }
                 isRunning.toggle()